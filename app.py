@@ -5,6 +5,12 @@ import json
 import time
 import re
 import random
+import tempfile
+import hashlib
+import sqlite3
+import threading
+import uuid
+from collections import OrderedDict
 from datetime import datetime, date
 from io import BytesIO
 
@@ -43,13 +49,20 @@ try:
 except ImportError: 
     Image = None
 
+try: 
+    import redis
+except ImportError: 
+    redis = None
+
 # Inicialização de Estado (Session State) com as melhorias de Retenção e Radar
+# Textos grandes (edital, OCR, áudio, mensagens do chat) guardam só o handle do blob em disco;
+# questões ficam internadas no backend e as listas guardam apenas os IDs.
 keys = {
     "user_xp": 0, "contract_step": 1, "contract_clauses": [], 
     "contract_meta": {}, "chat_history": [], "edital_text": "", 
     "edital_filename": "", "quiz_data": None, "quiz_show_answer": False, 
-    "user_choice": None, "ocr_text": "", "last_call": 0, "audio_text": "",
-    "oab_quiz_data": None, 
+    "user_choice": None, "ocr_text": "", "audio_text": "",
+    "oab_quiz_id": None, 
     "oab_show_answer": False, 
     "oab_choice": None,
     "oab_click_count": 0,
@@ -58,7 +71,9 @@ keys = {
     "oab_stats": {"total": 0, "acertos": 0, "erros": 0, "materias": {}},
     "historico_oab": [],
     "favoritas": [],
-    "coach_cronograma": None
+    "coach_cronograma": None,
+    "card_formato": None,
+    "export_docx": None
 }
 for k, v in keys.items():
     if k not in st.session_state: 
@@ -68,13 +83,268 @@ for k, v in keys.items():
 # 3. FUNÇÕES UTILITÁRIAS E LÓGICA (BACKEND)
 # =============================================================================
 
-def check_rate_limit():
-    if time.time() - st.session_state.last_call < 2.0: 
-        return True 
-    return False
+# --- BACKEND DE ESTADO COMPARTILHADO (rate limit, cache de respostas, banco de questões, progresso) ---
+BACKEND_PURGE_SECONDS = 300
+RATE_LIMIT_SECONDS = 2.0
+QUESTION_BANK_TTL = 30 * 86400
+PROGRESS_TTL = 90 * 86400
+MEMORY_BACKEND_MAX_ENTRIES = int(os.environ.get("MEMORY_BACKEND_MAX_ENTRIES", 20000))
+EVICTABLE_PREFIXES = ("resp:", "bank:")
+
+class MemoryBackend:
+    """Backend em memória do próprio processo (padrão; uma única réplica).
+    
+    Só caches regeneráveis (EVICTABLE_PREFIXES) entram no LRU de max_entries; questões e progresso dos
+    estudantes nunca são descartados por falta de espaço, apenas pelo TTL."""
+    def __init__(self, max_entries=MEMORY_BACKEND_MAX_ENTRIES):
+        self.data = {}
+        self.lru = OrderedDict()
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.last_purge = 0
+
+    def read(self, key, default=None):
+        item = self.data.get(key)
+        if item is None: return default
+        value, expires = item
+        if expires and expires < time.time():
+            self.drop(key)
+            return default
+        if key in self.lru: self.lru.move_to_end(key)
+        return json.loads(value)
+
+    def drop(self, key):
+        self.data.pop(key, None)
+        self.lru.pop(key, None)
+
+    def get(self, key, default=None):
+        with self.lock: return self.read(key, default)
+
+    def get_many(self, keys):
+        with self.lock: return {k: v for k in keys if (v := self.read(k)) is not None}
+
+    def set(self, key, value, ttl=None):
+        # Serializa como os backends compartilhados: sessões nunca compartilham objetos mutáveis.
+        with self.lock:
+            self.data[key] = (json.dumps(value, ensure_ascii=False), time.time() + ttl if ttl else None)
+            if key.startswith(EVICTABLE_PREFIXES):
+                self.lru[key] = None
+                self.lru.move_to_end(key)
+                while len(self.lru) > self.max_entries:
+                    self.data.pop(self.lru.popitem(last=False)[0], None)
+            self.purge_expired()
+
+    def touch(self, key, ttl):
+        with self.lock:
+            if key in self.data: self.data[key] = (self.data[key][0], time.time() + ttl)
+
+    def acquire(self, key, ttl):
+        """Reserva atômica: True só se a chave não existia (ou expirou); ela passa a valer por ttl segundos."""
+        with self.lock:
+            item = self.data.get(key)
+            now = time.time()
+            if item and item[1] and item[1] >= now: return False
+            self.data[key] = (json.dumps(now), now + ttl)
+            return True
+
+    def purge_expired(self):
+        now = time.time()
+        if now - self.last_purge < BACKEND_PURGE_SECONDS: return
+        self.last_purge = now
+        for k in [k for k, (_, exp) in self.data.items() if exp and exp < now]:
+            self.drop(k)
+
+    def delete(self, key):
+        with self.lock: self.drop(key)
+
+    def keys(self, prefix):
+        with self.lock:
+            now = time.time()
+            return [k for k, (_, exp) in self.data.items() if k.startswith(prefix) and not (exp and exp < now)]
+
+class SQLiteBackend:
+    """Backend em SQLite, compartilhável entre processos/réplicas via volume comum."""
+    def __init__(self, path):
+        self.path = path
+        self.last_purge = 0
+        self.execute("PRAGMA journal_mode=WAL")
+        self.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL)")
+
+    def execute(self, sql, params=(), rowcount=False):
+        con = sqlite3.connect(self.path, timeout=10)
+        try:
+            with con:
+                cur = con.execute(sql, params)
+                return cur.rowcount if rowcount else cur.fetchall()
+        finally: con.close()
+
+    def get(self, key, default=None):
+        rows = self.execute("SELECT value, expires FROM kv WHERE key = ?", (key,))
+        if not rows: return default
+        value, expires = rows[0]
+        if expires and expires < time.time():
+            self.delete(key)
+            return default
+        return json.loads(value)
+
+    def set(self, key, value, ttl=None):
+        self.execute("INSERT OR REPLACE INTO kv (key, value, expires) VALUES (?, ?, ?)",
+                     (key, json.dumps(value, ensure_ascii=False), time.time() + ttl if ttl else None))
+        self.purge_expired()
+
+    def get_many(self, keys):
+        keys = list(keys)
+        found = {}
+        for i in range(0, len(keys), 500):  # respeita o limite de parâmetros do SQLite
+            chunk = keys[i:i + 500]
+            rows = self.execute(f"SELECT key, value FROM kv WHERE key IN ({','.join('?' * len(chunk))}) "
+                                "AND (expires IS NULL OR expires >= ?)", (*chunk, time.time()))
+            found.update((k, json.loads(v)) for k, v in rows)
+        return found
+
+    def touch(self, key, ttl):
+        self.execute("UPDATE kv SET expires = ? WHERE key = ?", (time.time() + ttl, key))
+
+    def acquire(self, key, ttl):
+        """Reserva atômica entre processos: o upsert só altera a linha se a reserva anterior já expirou."""
+        now = time.time()
+        return self.execute("INSERT INTO kv (key, value, expires) VALUES (?, ?, ?) "
+                            "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires = excluded.expires "
+                            "WHERE kv.expires IS NOT NULL AND kv.expires < ?",
+                            (key, json.dumps(now), now + ttl, now), rowcount=True) == 1
+
+    def purge_expired(self):
+        # Linhas expiradas só sumiriam quando lidas; limpa tudo de tempos em tempos.
+        now = time.time()
+        if now - self.last_purge < BACKEND_PURGE_SECONDS: return
+        self.last_purge = now
+        self.execute("DELETE FROM kv WHERE expires IS NOT NULL AND expires < ?", (now,))
 
-def mark_call(): 
-    st.session_state.last_call = time.time()
+    def delete(self, key):
+        self.execute("DELETE FROM kv WHERE key = ?", (key,))
+
+    def keys(self, prefix):
+        pattern = re.sub(r"([\\%_])", r"\\\1", prefix) + "%"
+        rows = self.execute("SELECT key FROM kv WHERE key LIKE ? ESCAPE '\\' AND (expires IS NULL OR expires >= ?)",
+                            (pattern, time.time()))
+        return [r[0] for r in rows]
+
+class RedisBackend:
+    """Backend em qualquer servidor que fale o protocolo Redis (Redis, KeyDB, Valkey...)."""
+    def __init__(self, url):
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+
+    def get(self, key, default=None):
+        raw = self.client.get(key)
+        return default if raw is None else json.loads(raw)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(key, json.dumps(value, ensure_ascii=False), ex=max(1, int(ttl)) if ttl else None)
+
+    def get_many(self, keys):
+        keys = list(keys)
+        if not keys: return {}
+        return {k: json.loads(v) for k, v in zip(keys, self.client.mget(keys)) if v is not None}
+
+    def touch(self, key, ttl):
+        self.client.expire(key, max(1, int(ttl)))
+
+    def acquire(self, key, ttl):
+        return bool(self.client.set(key, json.dumps(time.time()), nx=True, px=max(1, int(ttl * 1000))))
+
+    def delete(self, key):
+        self.client.delete(key)
+
+    def keys(self, prefix):
+        return list(self.client.scan_iter(match=re.sub(r"([*?\[\]\\])", r"\\\1", prefix) + "*"))
+
+@st.cache_resource
+def get_state_backend():
+    """Escolhe o backend por STATE_BACKEND: 'memory' (padrão), 'sqlite:///caminho.db' ou 'redis://host:porta/0'."""
+    url = os.environ.get("STATE_BACKEND")
+    if not url:
+        try: url = st.secrets.get("STATE_BACKEND", "memory")
+        except Exception: url = "memory"
+    if url.startswith("sqlite:///"):
+        return SQLiteBackend(url[len("sqlite:///"):])
+    if url.startswith(("redis://", "rediss://")):
+        if not redis: raise RuntimeError("STATE_BACKEND aponta para Redis, mas o pacote 'redis' não está instalado.")
+        return RedisBackend(url)
+    return MemoryBackend()
+
+def content_hash(obj):
+    return hashlib.sha256(json.dumps(obj, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+
+def acquire_rate_limit():
+    """No máximo uma chamada a cada RATE_LIMIT_SECONDS por estudante, valendo entre réplicas.
+    
+    Como no limite original por sessão, quem chama antes do tempo espera 1s e segue."""
+    key = f"rate:{st.session_state.get('user_id', 'anon')}"
+    if not get_state_backend().acquire(key, RATE_LIMIT_SECONDS):
+        time.sleep(1)
+
+PROGRESS_KEYS = ["user_xp", "oab_stats", "historico_oab", "caderno_erros", "favoritas"]
+
+def progress_snapshot():
+    # Cópia profunda: as listas da sessão são alteradas in-place.
+    return json.loads(json.dumps({k: st.session_state[k] for k in PROGRESS_KEYS}, ensure_ascii=False))
+
+def load_user_progress():
+    """Identifica o estudante pelo parâmetro ?u= da URL e restaura o progresso salvo no backend.
+    
+    Não há autenticação: o valor de ?u= funciona como senha de portador, e quem tiver o link lê e altera o progresso."""
+    uid = st.query_params.get("u")
+    if not uid:
+        uid = uuid.uuid4().hex
+        st.query_params["u"] = uid
+    st.session_state.user_id = uid
+    backend = get_state_backend()
+    saved = backend.get(f"progress:{uid}")
+    if saved:
+        for k in PROGRESS_KEYS:
+            if k in saved: st.session_state[k] = saved[k]
+        # Progresso antigo guardava as questões inteiras; converte para IDs internados.
+        if any(isinstance(q, dict) for k in ("caderno_erros", "favoritas") for q in st.session_state[k]):
+            for k in ("caderno_erros", "favoritas"):
+                st.session_state[k] = [intern_question(q) if isinstance(q, dict) else q for q in st.session_state[k]]
+            backend.set(f"progress:{uid}", progress_snapshot(), ttl=PROGRESS_TTL)
+        # As questões referenciadas vivem tanto quanto o progresso.
+        for qid in set(st.session_state.caderno_erros + st.session_state.favoritas):
+            backend.touch(f"q:{qid}", PROGRESS_TTL)
+    st.session_state.progress_base = progress_snapshot()
+
+def merge_progress(stored, base, mine):
+    """Aplica sobre o snapshot salvo só o que esta sessão mudou desde base, sem apagar o que outras abas/réplicas gravaram."""
+    merged = dict(stored)
+    merged["user_xp"] = stored.get("user_xp", 0) + mine["user_xp"] - base.get("user_xp", 0)
+    stats = dict(stored.get("oab_stats") or {"total": 0, "acertos": 0, "erros": 0, "materias": {}})
+    base_stats = base.get("oab_stats") or {}
+    for k in ("total", "acertos", "erros"):
+        stats[k] = stats.get(k, 0) + mine["oab_stats"].get(k, 0) - base_stats.get(k, 0)
+    stats["materias"] = {**stats.get("materias", {}), **mine["oab_stats"].get("materias", {})}
+    merged["oab_stats"] = stats
+    merged["historico_oab"] = stored.get("historico_oab", []) + mine["historico_oab"][len(base.get("historico_oab", [])):]
+    for k in ("caderno_erros", "favoritas"):
+        merged[k] = stored.get(k, []) + [x for x in mine[k] if x not in stored.get(k, [])]
+    return merged
+
+def save_user_progress():
+    """Grava o progresso mesclando com o que já está salvo (sob uma trava curta no backend)."""
+    mine = progress_snapshot()
+    base = st.session_state.progress_base
+    if content_hash(mine) == content_hash(base): return
+    backend = get_state_backend()
+    key = f"progress:{st.session_state.user_id}"
+    deadline = time.time() + 2
+    while not backend.acquire(f"lock:{key}", 5) and time.time() < deadline:
+        time.sleep(0.05)
+    try:
+        merged = merge_progress(backend.get(key) or base, base, mine)
+        backend.set(key, merged, ttl=PROGRESS_TTL)
+    finally:
+        backend.delete(f"lock:{key}")
+    for k in PROGRESS_KEYS: st.session_state[k] = merged[k]
+    st.session_state.progress_base = progress_snapshot()
 
 def add_xp(amount):
     st.session_state.user_xp += amount
@@ -108,9 +378,161 @@ def get_best_model():
     except Exception as e: 
         return None, f"Erro Fatal: {str(e)}"
 
-def call_gemini(system_prompt, user_prompt, json_mode=False, image=None, audio_bytes=None, audio_mime=None, use_search=False):
-    if check_rate_limit(): time.sleep(1)
-    mark_call()
+# --- GERENCIADOR DE MEMÓRIA DAS SESSÕES (blobs em disco + cache quente limitado por sessão) ---
+BLOB_DIR = os.environ.get("CARMELIO_BLOB_DIR", os.path.join(tempfile.gettempdir(), "carmelio_blobs"))
+SESSION_MEMORY_BUDGET = int(os.environ.get("SESSION_MEMORY_BUDGET", 2 * 1024 * 1024))  # bytes por sessão
+SESSION_IDLE_SECONDS = 15 * 60
+BLOB_MAX_AGE_SECONDS = 7 * 86400
+
+class SessionMemoryManager:
+    """Guarda textos grandes em disco (endereçados por hash) e mantém em RAM só um cache LRU por sessão.
+    
+    O cache de cada sessão respeita o orçamento SESSION_MEMORY_BUDGET e é descartado quando a sessão fica ociosa."""
+    def __init__(self, blob_dir, budget, idle_seconds):
+        self.blob_dir = blob_dir
+        self.budget = budget
+        self.idle_seconds = idle_seconds
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.last_sweep = 0
+        # Chats, OCR de documentos cartoriais e transcrições: diretório e arquivos só do usuário do processo.
+        os.makedirs(blob_dir, mode=0o700, exist_ok=True)
+        os.chmod(blob_dir, 0o700)
+
+    def blob_path(self, handle):
+        return os.path.join(self.blob_dir, f"{handle}.txt")
+
+    def export_path(self, sid):
+        return os.path.join(self.blob_dir, f"export_{sid}.docx")
+
+    def session(self, sid):
+        return self.sessions.setdefault(sid, {"last_seen": time.time(), "resident": 0, "hot": OrderedDict(), "hot_bytes": 0})
+
+    def put(self, sid, text):
+        handle = hashlib.sha256(text.encode("utf-8")).hexdigest()[:24]
+        path = self.blob_path(handle)
+        if os.path.exists(path):
+            os.utime(path)  # renova o mtime para o sweep não apagar um blob recém-entregue
+        else:
+            tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+            with os.fdopen(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), "w", encoding="utf-8") as f: f.write(text)
+            os.replace(tmp, path)
+        with self.lock: self.cache(self.session(sid), handle, text)
+        return handle
+
+    def get(self, sid, handle):
+        """Retorna o texto do blob; "" para handle vazio e None se o blob não existe mais em disco."""
+        if not handle: return ""
+        with self.lock:
+            sess = self.session(sid)
+            text = sess["hot"].get(handle)
+            if text is not None: sess["hot"].move_to_end(handle)
+        try:
+            if text is None:
+                with open(self.blob_path(handle), encoding="utf-8") as f: text = f.read()
+            os.utime(self.blob_path(handle))
+        except OSError:
+            return text
+        with self.lock: self.cache(self.session(sid), handle, text)
+        return text
+
+    def cache(self, sess, handle, text):
+        if handle in sess["hot"]:
+            sess["hot"].move_to_end(handle)
+            return
+        sess["hot"][handle] = text
+        sess["hot_bytes"] += len(text.encode("utf-8"))
+        self.shrink(sess)
+
+    def shrink(self, sess):
+        limite = max(0, self.budget - sess["resident"])
+        while sess["hot_bytes"] > limite and sess["hot"]:
+            _, old = sess["hot"].popitem(last=False)
+            sess["hot_bytes"] -= len(old.encode("utf-8"))
+
+    def touch(self, sid, resident_bytes):
+        with self.lock:
+            sess = self.session(sid)
+            sess["last_seen"] = time.time()
+            sess["resident"] = resident_bytes
+            self.shrink(sess)
+        self.sweep()
+
+    def sweep(self):
+        """Descarta o cache de sessões ociosas e apaga blobs sem acesso há muito tempo (no máximo 1x por minuto)."""
+        now = time.time()
+        with self.lock:
+            if now - self.last_sweep < 60: return
+            self.last_sweep = now
+            ociosas = [k for k, v in self.sessions.items() if now - v["last_seen"] > self.idle_seconds]
+            for sid in ociosas:
+                del self.sessions[sid]
+        for sid in ociosas:
+            try: os.remove(self.export_path(sid))
+            except OSError: pass
+        for name in os.listdir(self.blob_dir):
+            path = os.path.join(self.blob_dir, name)
+            try:
+                if now - os.path.getmtime(path) > BLOB_MAX_AGE_SECONDS: os.remove(path)
+            except OSError: pass
+
+    def usage(self, sid):
+        with self.lock:
+            sess = self.session(sid)
+            return {"resident": sess["resident"], "hot": sess["hot_bytes"], "budget": self.budget}
+
+@st.cache_resource
+def get_memory_manager():
+    return SessionMemoryManager(BLOB_DIR, SESSION_MEMORY_BUDGET, SESSION_IDLE_SECONDS)
+
+def estimate_size(value):
+    if isinstance(value, bytes): return len(value)
+    try: return len(json.dumps(value, ensure_ascii=False, default=str).encode("utf-8"))
+    except (TypeError, ValueError): return 0
+
+def store_text(text):
+    return get_memory_manager().put(st.session_state.session_mem_id, text) if text else ""
+
+def load_text(handle):
+    text = get_memory_manager().get(st.session_state.session_mem_id, handle)
+    if text is None:
+        st.warning("⚠️ Este conteúdo expirou do armazenamento temporário e não pôde ser recuperado.")
+        return ""
+    return text
+
+def enforce_session_budget():
+    """Mede o estado residente da sessão; o cache quente de blobs encolhe para caber no que sobra do orçamento.
+    
+    Resultados visíveis ao usuário nunca são apagados: o estado residente (IDs, estatísticas, histórico) é só medido."""
+    resident = sum(estimate_size(v) for v in st.session_state.to_dict().values())
+    get_memory_manager().touch(st.session_state.session_mem_id, resident)
+
+def intern_question(q):
+    qid = content_hash(q)
+    backend = get_state_backend()
+    if backend.get(f"q:{qid}") is None: backend.set(f"q:{qid}", q, ttl=PROGRESS_TTL)
+    else: backend.touch(f"q:{qid}", PROGRESS_TTL)
+    return qid
+
+def get_question(qid):
+    return get_state_backend().get(f"q:{qid}") if qid else None
+
+def load_questions(qids):
+    """Carrega várias questões numa única ida ao backend; avisa se alguma não existe mais."""
+    found = get_state_backend().get_many(f"q:{qid}" for qid in qids)
+    questoes = [found[f"q:{qid}"] for qid in qids if f"q:{qid}" in found]
+    if len(questoes) < len(qids):
+        st.warning(f"⚠️ {len(qids) - len(questoes)} questão(ões) salva(s) expiraram e não puderam ser carregadas.")
+    return questoes
+
+def call_gemini(system_prompt, user_prompt, json_mode=False, image=None, audio_bytes=None, audio_mime=None, use_search=False, cache_ttl=None):
+    """Chama o Gemini. Com cache_ttl (segundos), respostas de texto são reaproveitadas do backend compartilhado."""
+    cache_key = None
+    if cache_ttl and not image and not audio_bytes:
+        cache_key = "resp:" + content_hash([system_prompt, user_prompt, json_mode, use_search])
+        cached = get_state_backend().get(cache_key)
+        if cached is not None: return cached
+    acquire_rate_limit()
     model, name = get_best_model()
     if not model: return f"Erro: {name}"
     try:
@@ -125,6 +547,7 @@ def call_gemini(system_prompt, user_prompt, json_mode=False, image=None, audio_b
         if json_mode: full_prompt += "\nFORMAT: Return ONLY valid JSON. No Markdown."
         
         response = model.generate_content(full_prompt, tools=tools_config) if tools_config else model.generate_content(full_prompt)
+        if cache_key: get_state_backend().set(cache_key, response.text, ttl=cache_ttl)
         return response.text
     except Exception as e: 
         if "429" in str(e): return "⚠️ Limite de velocidade atingido. Aguarde 30 segundos."
@@ -179,25 +602,102 @@ def create_contract_docx(clauses, meta):
     buffer.seek(0)
     return buffer
 
-def generate_performance_card(acertos, total, taxa):
-    """Gera o card de desempenho compartilhável no Instagram (Marketing Orgânico)."""
-    if not Image: return None
-    img = Image.new("RGB", (600, 400), color="#11141d")
+@st.cache_data(max_entries=2048, show_spinner=False)
+def render_question_section(q):
+    """Converte uma questão em blocos (tipo, texto) prontos para o DOCX. Cacheado por questão."""
+    blocos = [("h2", f"{q.get('materia', 'Questão')} | {q.get('exame', 'Exame OAB FGV')}")]
+    blocos.append(("p", q.get('enunciado', '')))
+    for l, t in (q.get('alternativas') or {}).items():
+        blocos.append(("p", f"{l}) {t}"))
+    blocos.append(("b", f"Gabarito: Letra {q.get('correta', '?')}"))
+    for campo, rotulo in [("fundamentacao", "Fundamentação"), ("artigo", "Artigo Aplicável"), ("pegadinha", "Pegadinha da FGV"), ("dica", "Dica para a Prova")]:
+        if q.get(campo): blocos.append(("p", f"{rotulo}: {q[campo]}"))
+    return blocos
+
+def render_chat_section(history):
+    blocos = []
+    for msg in history:
+        blocos.append(("b", "Você:" if msg["role"] == "user" else "Mentor Jurídico:"))
+        blocos.extend(("p", line.strip()) for line in msg["content"].split('\n') if line.strip())
+    return blocos
+
+def render_text_section(content):
+    return [("p", line.strip()) for line in content.split('\n') if line.strip()]
+
+def create_bulk_export_docx(secoes, path, title="Material de Estudo Carmélio AI"):
+    """Monta um único DOCX com várias seções [(titulo, [blocos, ...])] e grava em path (permissão 0600).
+    
+    O Document é montado em memória (o python-docx não grava incrementalmente), mas o resultado vai para disco
+    e a sessão guarda só o caminho."""
+    if not docx: return None
+    doc = Document()
+    doc.add_heading(title, 0)
+    doc.add_paragraph(f"Gerado em: {datetime.now().strftime('%d/%m/%Y')}")
+    for titulo, itens in secoes:
+        doc.add_heading(titulo, level=1)
+        for blocos in itens:
+            for tipo, texto in blocos:
+                if tipo == "h2": doc.add_heading(texto, level=2)
+                elif tipo == "b": doc.add_paragraph().add_run(texto).bold = True
+                else: doc.add_paragraph(texto)
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    with os.fdopen(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), "wb") as f: doc.save(f)
+    os.replace(tmp, path)
+    return path
+
+CARD_FORMATOS = {
+    "classico": {"label": "Clássico (600x400)", "size": (600, 400)},
+    "feed": {"label": "Instagram Feed (1080x1080)", "size": (1080, 1080)},
+    "story": {"label": "Instagram Story (1080x1920)", "size": (1080, 1920)},
+}
+CARD_FONTES = [
+    "DejaVuSans-Bold.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
+    "/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf",
+    "arialbd.ttf",
+]
+
+@st.cache_resource
+def get_card_font(size):
+    """Carrega a fonte TrueType do card uma única vez por tamanho (fallback para a fonte padrão do PIL)."""
+    for path in CARD_FONTES:
+        try: return ImageFont.truetype(path, size)
+        except OSError: continue
+    try: return ImageFont.load_default(size=size)
+    except TypeError: return ImageFont.load_default()
+
+@st.cache_resource
+def get_card_template(formato):
+    """Pré-renderiza o fundo estático do card (moldura e textos fixos) para cada formato."""
+    w, h = CARD_FORMATOS[formato]["size"]
+    s = w / 600
+    img = Image.new("RGB", (w, h), color="#11141d")
     draw = ImageDraw.Draw(img)
-    draw.rectangle([15, 15, 585, 385], outline="#2563EB", width=3)
+    m = int(15 * s)
+    draw.rectangle([m, m, w - m, h - m], outline="#2563EB", width=max(3, int(3 * s)))
     
-    draw.text((300, 60), "CARMÉLIO AI", fill="#ffffff", anchor="mm")
-    draw.text((300, 100), "PROJETO 40 ACERTOS | OAB 47", fill="#F59E0B", anchor="mm")
+    draw.text((w / 2, h * 0.15), "CARMÉLIO AI", fill="#ffffff", anchor="mm", font=get_card_font(int(30 * s)))
+    draw.text((w / 2, h * 0.25), "PROJETO 40 ACERTOS | OAB 47", fill="#F59E0B", anchor="mm", font=get_card_font(int(18 * s)))
+    draw.text((w / 2, h * 0.825), "Rumo à Aprovação Exame de Ordem", fill="#8B949E", anchor="mm", font=get_card_font(int(15 * s)))
+    return img
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def generate_performance_card(acertos, total, taxa, formato="classico"):
+    """Gera o card de desempenho compartilhável no Instagram (Marketing Orgânico).
     
-    draw.text((300, 180), f"Acertos: {acertos} de {total}", fill="#34D399", anchor="mm")
-    draw.text((300, 240), f"Taxa de Performance: {taxa}%", fill="#4285F4", anchor="mm")
+    Memoizado por (acertos, total, taxa, formato): só os números são desenhados sobre o template pronto."""
+    if not Image: return None
+    img = get_card_template(formato).copy()
+    w, h = img.size
+    s = w / 600
+    draw = ImageDraw.Draw(img)
     
-    draw.text((300, 330), "Rumo à Aprovação Exame de Ordem", fill="#8B949E", anchor="mm")
+    draw.text((w / 2, h * 0.45), f"Acertos: {acertos} de {total}", fill="#34D399", anchor="mm", font=get_card_font(int(26 * s)))
+    draw.text((w / 2, h * 0.60), f"Taxa de Performance: {taxa}%", fill="#4285F4", anchor="mm", font=get_card_font(int(24 * s)))
     
     buf = BytesIO()
     img.save(buf, format="PNG")
-    buf.seek(0)
-    return buf
+    return buf.getvalue()
 
 def get_daily_verse():
     versiculos = [
@@ -390,6 +890,12 @@ def render_sidebar_widgets():
 # =============================================================================
 # 5. EXECUÇÃO PRINCIPAL E FLUXO DE TELAS
 # =============================================================================
+if "user_id" not in st.session_state:
+    load_user_progress()
+if "session_mem_id" not in st.session_state:
+    st.session_state.session_mem_id = uuid.uuid4().hex
+enforce_session_budget()
+
 with st.sidebar:
     safe_image_show("carmelio_logo.png.png")
     st.caption(f"⚡ Nível Atual: **{get_rank_badge(st.session_state.user_xp)}**")
@@ -412,6 +918,9 @@ with st.sidebar:
     
     st.markdown("---")
     st.write(f"📊 **Questões Respondidas:** {st.session_state.oab_stats['total']}")
+    st.caption("🔑 Seu progresso fica salvo no link desta página: guarde-o e não o compartilhe.")
+    mem = get_memory_manager().usage(st.session_state.session_mem_id)
+    st.caption(f"💾 Memória da sessão: {(mem['resident'] + mem['hot']) / 1024:.0f} KB de {mem['budget'] / 1024:.0f} KB")
     st.progress(min((st.session_state.user_xp % 100) / 100, 1.0))
     st.markdown("""<div class='footer-credits'>Desenvolvido por<br><strong>Arthur Carmélio</strong><br>© 2026 Carmélio AI</div>""", unsafe_allow_html=True)
 
@@ -425,9 +934,9 @@ def verificar_acesso_premium():
 if menu == "🎓 Gabaritando a OAB":
     st.title("🎓 Ecossistema de Aprovação OAB 47")
     
-    t1, t2, t3, t4, t5 = st.tabs([
+    t1, t2, t3, t4, t5, t6 = st.tabs([
         "🎯 1ª Fase - Simulador FGV", "📊 Meu Desempenho & Coach", 
-        "✍️ 2ª Fase - Corretora", "📚 Caderno de Erros", "⭐ Favoritas"
+        "✍️ 2ª Fase - Corretora", "📚 Caderno de Erros", "⭐ Favoritas", "📦 Exportar Material"
     ])
     
     with t1:
@@ -439,7 +948,7 @@ if menu == "🎓 Gabaritando a OAB":
         ]
 
         def gerar_questao_oab(materia_selecionada):
-            st.session_state["oab_quiz_data"] = None
+            st.session_state["oab_quiz_id"] = None
             st.session_state["oab_show_answer"] = False
             st.session_state.oab_click_count += 1
             
@@ -462,7 +971,18 @@ if menu == "🎓 Gabaritando a OAB":
                 """
                 res = call_gemini("JSON Only.", prompt, json_mode=True, use_search=True)
                 data = extract_json_surgical(res)
-                if data: st.session_state["oab_quiz_data"] = data
+                backend = get_state_backend()
+                qid = None
+                if data:
+                    qid = intern_question(data)
+                    backend.set(f"bank:{materia_selecionada}:{qid}", True, ttl=QUESTION_BANK_TTL)
+                else:
+                    # Falha da IA: recorre ao banco de questões compartilhado já gerado por outros estudantes.
+                    salvas = backend.keys(f"bank:{materia_selecionada}:")
+                    if salvas:
+                        qid = random.choice(salvas).rsplit(":", 1)[1]
+                        st.toast("IA indisponível: questão servida do banco local.", icon="🗃️")
+                st.session_state["oab_quiz_id"] = qid
 
         col_m, col_b = st.columns([2, 1])
         with col_m:
@@ -473,15 +993,16 @@ if menu == "🎓 Gabaritando a OAB":
                 gerar_questao_oab(mat_escolhida)
                 st.rerun()
 
-        if st.session_state.get("oab_quiz_data") is not None:
-            q = st.session_state["oab_quiz_data"]
+        q = get_question(st.session_state.oab_quiz_id)
+        if q is not None:
+            qid = st.session_state.oab_quiz_id
             st.markdown(f"### 📝 {q.get('exame', 'Exame de Ordem')} | Matéria: {q.get('materia', mat_escolhida)}")
             st.info(q['enunciado'])
             opts = q['alternativas']
             
             if st.button("⭐ Salvar nas Favoritas", key="fav_btn"):
-                if q not in st.session_state.favoritas:
-                    st.session_state.favoritas.append(q)
+                if qid not in st.session_state.favoritas:
+                    st.session_state.favoritas.append(qid)
                     st.toast("Questão arquivada na aba de Favoritas!", icon="⭐")
 
             if not st.session_state["oab_show_answer"]:
@@ -500,8 +1021,8 @@ if menu == "🎓 Gabaritando a OAB":
                         st.session_state.oab_stats["acertos"] += 1
                     else:
                         st.session_state.oab_stats["erros"] += 1
-                        if q not in st.session_state.caderno_erros:
-                            st.session_state.caderno_erros.append(q)
+                        if qid not in st.session_state.caderno_erros:
+                            st.session_state.caderno_erros.append(qid)
                     
                     st.session_state.historico_oab.append({
                         "materia": q.get('materia', mat_escolhida),
@@ -562,9 +1083,18 @@ if menu == "🎓 Gabaritando a OAB":
 
             st.markdown("---")
             st.markdown("#### 📸 Compartilhe suas conquistas no Instagram!")
-            card_btn = generate_performance_card(st_a, st_t, taxa_calculada)
-            if card_btn:
-                st.download_button("📸 Baixar Card de Desempenho", card_btn, "Desempenho_OAB.png", "image/png")
+            fc1, fc2 = st.columns([2, 1])
+            formato_card = fc1.selectbox("Formato do card:", list(CARD_FORMATOS), format_func=lambda f: CARD_FORMATOS[f]["label"], key="sb_card_fmt")
+            with fc2:
+                st.write(""); st.write("")
+                if st.button("🎨 Preparar Card", use_container_width=True, key="btn_card"):
+                    st.session_state.card_formato = formato_card
+            
+            # O PNG só é gerado após o pedido do usuário; reruns seguintes reaproveitam o cache.
+            if st.session_state.card_formato:
+                card_png = generate_performance_card(st_a, st_t, taxa_calculada, st.session_state.card_formato)
+                if card_png:
+                    st.download_button("📸 Baixar Card de Desempenho", card_png, f"Desempenho_OAB_{st.session_state.card_formato}.png", "image/png")
         else:
             st.info("Comece a treinar na aba ao lado para gerar seu radar estatístico.")
 
@@ -577,7 +1107,7 @@ if menu == "🎓 Gabaritando a OAB":
         if st.button("🗺️ GERAR MEU CRONOGRAMA INTEGRADO", type="primary"):
             with st.spinner("IA calculando pontos de recorrência da FGV..."):
                 prompt_coach = f"Crie um planejamento estratégico de estudos para a OAB 1ª Fase. Dias disponíveis: {dias_r}, Horas por dia: {horas_d}. Distribua o tempo dando prioridade máxima para Ética (8 questões), Constitucional, Administrativo, Civil e Penal. Retorne em formato Markdown estruturado."
-                st.session_state.coach_cronograma = call_gemini("Você é um Coach Mentor especialista em Exame de Ordem.", prompt_coach)
+                st.session_state.coach_cronograma = call_gemini("Você é um Coach Mentor especialista em Exame de Ordem.", prompt_coach, cache_ttl=86400)
         
         if st.session_state.coach_cronograma:
             st.markdown(st.session_state.coach_cronograma)
@@ -598,7 +1128,7 @@ if menu == "🎓 Gabaritando a OAB":
         if st.button("⚖️ ANALISAR PEÇA", type="primary"):
             if peca_txt:
                 with st.spinner("Avaliando técnica estrutural e adequação de pedidos..."):
-                    res_peca = call_gemini("Membro da banca examinadora FGV.", f"Dê nota de 0 a 5.0 e aponte erros estruturais e de fundamentação na peça de {area_2f}: \n{peca_txt}")
+                    res_peca = call_gemini("Membro da banca examinadora FGV.", f"Dê nota de 0 a 5.0 e aponte erros estruturais e de fundamentação na peça de {area_2f}: \n{peca_txt}", cache_ttl=86400)
                     st.markdown(res_peca)
             else: st.error("Cole o texto da peça jurídica.")
 
@@ -607,7 +1137,7 @@ if menu == "🎓 Gabaritando a OAB":
         if not st.session_state.caderno_erros:
             st.info("Seu caderno está limpo! Erros cometidos no simulador serão salvos aqui automaticamente.")
         else:
-            for i, err in enumerate(st.session_state.caderno_erros):
+            for i, err in enumerate(load_questions(st.session_state.caderno_erros)):
                 with st.expander(f"❌ Questão {i+1} - Matéria: {err.get('materia')}"):
                     st.write(err["enunciado"])
                     st.warning(f"Gabarito Oficial: Letra {err['correta']}")
@@ -618,12 +1148,35 @@ if menu == "🎓 Gabaritando a OAB":
         if not st.session_state.favoritas:
             st.info("Você ainda não salvou nenhuma questão. Marque as mais complexas no simulador principal.")
         else:
-            for idx, fav in enumerate(st.session_state.favoritas):
+            for idx, fav in enumerate(load_questions(st.session_state.favoritas)):
                 with st.expander(f"⭐ Favorita {idx+1} | {fav.get('materia')}"):
                     st.write(fav["enunciado"])
                     st.info(f"Gabarito Correto: {fav['correta']}")
                     st.write(fav.get('fundamentacao'))
 
+    with t6:
+        st.subheader("📦 Exportação em Lote para Word")
+        fontes_export = {
+            "📚 Caderno de Erros": ("Caderno de Erros", lambda: [render_question_section(q) for q in load_questions(st.session_state.caderno_erros)]),
+            "⭐ Favoritas": ("Questões Favoritas", lambda: [render_question_section(q) for q in load_questions(st.session_state.favoritas)]),
+            "✨ Chat Inteligente": ("Transcrição do Chat", lambda: [render_chat_section([{"role": m["role"], "content": load_text(m["blob"])} for m in st.session_state.chat_history])] if st.session_state.chat_history else []),
+            "🏢 Cartório OCR": ("Texto Extraído (OCR)", lambda: [render_text_section(load_text(st.session_state.ocr_text))] if st.session_state.ocr_text else []),
+            "🎙️ Transcrição": ("Transcrição de Áudio", lambda: [render_text_section(load_text(st.session_state.audio_text))] if st.session_state.audio_text else []),
+        }
+        escolhidas = st.multiselect("Conteúdo a exportar:", list(fontes_export), default=["📚 Caderno de Erros", "⭐ Favoritas"])
+        if st.button("📦 GERAR DOCUMENTO", type="primary", key="btn_export"):
+            with st.spinner("Montando documento..."):
+                secoes = [(fontes_export[f][0], fontes_export[f][1]()) for f in escolhidas]
+                secoes = [(titulo, itens) for titulo, itens in secoes if itens]
+                export_path = get_memory_manager().export_path(st.session_state.session_mem_id)
+                st.session_state.export_docx = create_bulk_export_docx(secoes, export_path) if secoes else None
+                if not secoes: st.info("Nada para exportar nas seções escolhidas.")
+        
+        # O caminho fica na sessão para o botão sobreviver ao rerun disparado pelo próprio download.
+        if st.session_state.export_docx and os.path.exists(st.session_state.export_docx):
+            with open(st.session_state.export_docx, "rb") as f:
+                st.download_button("💾 Baixar Material em Word (.docx)", f, "Material_CarmelioAI.docx", type="primary")
+
 # =============================================================================
 # OUTROS MÓDULOS JURÍDICOS (ACESSO DIRETO)
 # =============================================================================
@@ -633,16 +1186,16 @@ elif menu == "✨ Chat Inteligente":
     if not st.session_state.chat_history: 
         st.markdown("""<div class="onboarding-box"><h4>👋 Bem-vindo ao Modo Direto</h4><p>Sou seu <b>Mentor Jurídico</b> de acesso livre. Dúvidas, consultas, petições ou jurisprudências?</p></div>""", unsafe_allow_html=True)
     for msg in st.session_state.chat_history:
-        with st.chat_message(msg["role"], avatar="🧑‍⚖️" if msg["role"] == "user" else "🤖"): st.markdown(msg["content"])
+        with st.chat_message(msg["role"], avatar="🧑‍⚖️" if msg["role"] == "user" else "🤖"): st.markdown(load_text(msg["blob"]))
     if p := st.chat_input("Digite sua dúvida legal aqui..."):
-        st.session_state.chat_history.append({"role": "user", "content": p})
+        st.session_state.chat_history.append({"role": "user", "blob": store_text(p)})
         with st.chat_message("user", avatar="🧑‍⚖️"): st.write(p)
         with st.chat_message("assistant", avatar="🤖"):
             with st.spinner("Analisando bases..."):
-                history = "\n".join([f"{m['role']}: {m['content']}" for m in st.session_state.chat_history[-6:]])
+                history = "\n".join([f"{m['role']}: {load_text(m['blob'])}" for m in st.session_state.chat_history[-6:]])
                 res = call_gemini("Advogado Sênior experiente.", history, use_search=True)
                 st.write(res)
-                st.session_state.chat_history.append({"role": "assistant", "content": res})
+                st.session_state.chat_history.append({"role": "assistant", "blob": store_text(res)})
                 add_xp(5)
 
 elif menu == "📝 Gere seu Contrato":
@@ -695,7 +1248,7 @@ elif menu == "🎯 Mestre dos Editais":
             with st.spinner("Escaneando anexos de conhecimentos específicos..."):
                 txt = read_pdf_safe(f)
                 if txt:
-                    st.session_state.edital_text = txt
+                    st.session_state.edital_text = store_text(txt)
                     st.session_state.edital_filename = f.name
                     st.rerun()
     else:
@@ -714,10 +1267,10 @@ elif menu == "🏢 Cartório OCR":
         if st.button("🔍 Extrair Texto Completo", type="primary"):
             with st.spinner("Processando OCR neural..."):
                 res = call_gemini("Especialista em OCR cartorial e transcrição de livros.", "Transcreva mantendo fielmente pontuações e parágrafos.", image=image)
-                st.session_state.ocr_text = res
+                st.session_state.ocr_text = store_text(res)
                 add_xp(30)
     if st.session_state.ocr_text: 
-        st.text_area("Texto Extraído:", st.session_state.ocr_text, height=300)
+        st.text_area("Texto Extraído:", load_text(st.session_state.ocr_text), height=300)
 
 elif menu == "🎙️ Transcrição":
     st.title("🎙️ Transcrição de Áudio Real")
@@ -728,7 +1281,10 @@ elif menu == "🎙️ Transcrição":
             with st.spinner("Processando ondas sonoras..."):
                 mime = "audio/mp3" if audio_file.name.endswith("mp3") else "audio/wav"
                 res = call_gemini("Transcreva organizando em parágrafos e corrigindo terminologias do direito.", "Transcreva o áudio.", audio_bytes=audio_file.getvalue(), audio_mime=mime)
-                st.session_state.audio_text = res
+                st.session_state.audio_text = store_text(res)
                 add_xp(40)
     if st.session_state.audio_text: 
-        st.text_area("Resultado:", st.session_state.audio_text, height=250)
+        st.text_area("Resultado:", load_text(st.session_state.audio_text), height=250)
+
+# Persiste o progresso no backend compartilhado (só grava quando algo mudou).
+save_user_progress()